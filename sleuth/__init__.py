@@ -4,8 +4,8 @@ Sleuth: A debugging and diagnostic tool for Python.
 """
 
 import sys
-if sys.version_info[:2] < (3, 0):
-    raise ImportError("Sleuth requires Python 3.")
+if sys.version_info[:2] < (3, 10):
+    raise ImportError("Sleuth requires Python 3.10 or later.")
 del sys
 
 __version__ = '0.2.0d'
@@ -1,15 +1,16 @@
 import argparse
 import os
 import sys
+from functools import lru_cache
 
 from . import __version__
-from .error import SleuthError, SleuthNotFoundError
+from .error import SleuthNotFoundError
 
 
 def _parse_args():
     parser = argparse.ArgumentParser(prog='python -m {0}'.format(__package__),
                                      description='Sleuth: A debugging and '
-                                     'diagnostic tool for Python 3.x')
+                                     'diagnostic tool for Python 3.10+')
     parser.add_argument('--version', '-v', action='version',
                         version='Sleuth {0}'.format(__version__))
     parser.add_argument('--config', '-c', metavar='SLEUTHCONFIG',
@@ -27,8 +28,13 @@ def _parse_args():
 
 
 def _find_config():
+    return _search_config(tuple(sys.path))
+
+
+@lru_cache(maxsize=16)
+def _search_config(paths):
     configFile = 'sleuthconfig.py'
-    for path in sys.path:
+    for path in paths:
         configPath = os.path.join(path, configFile)
         if os.path.isfile(configPath):
             return configPath
@@ -37,28 +43,33 @@ def _find_config():
 
 
 def _run(configFile, pyfile, preserve=False):
+    exec_context = {'__name__': '__main__', '__file__': pyfile,
+                    '__builtins__': __builtins__}
+
     def cleanup():
         # Set the context for executing the Python file. This cleans up some of
         # the effects to __main__.__dict__ caused by Sleuth.
         import __main__
-        exec_context = {'__name__': '__main__', '__file__': pyfile,
-                        '__builtins__': __builtins__}
         __main__.__dict__.clear()
         __main__.__dict__.update(exec_context)
         globals_ = locals_ = __main__.__dict__
         return globals_, locals_
 
+    from sleuth._util import compile_, read_source
     from sleuth.inject import Injector
     with Injector() as inj:
-        # Execute the config file
-        with open(configFile, 'rb') as f:
-            code = compile(f.read(), configFile, 'exec')
+        exec_context.update(inj.hook_globals())
+
+        # Execute the config file. It runs in __main__.__dict__, since
+        # functions defined in it belong to the __main__ module and tap()
+        # looks for them there.
+        code = compile_(read_source(configFile), configFile)
         globals_, locals_ = cleanup()
         exec(code, globals_, locals_)
 
         # Execute the Python file
-        modified_code = inj.inject_hooks(pyfile)
-        code = compile(modified_code, pyfile, 'exec')
+        tree = inj.inject_hooks(pyfile)
+        code = compile(tree, pyfile, 'exec')
         globals_, locals_ = (globals_, locals_) if preserve else cleanup()
         exec(code, globals_, locals_)
 
@@ -66,13 +77,15 @@ def _run(configFile, pyfile, preserve=False):
 def main():
     args = _parse_args()
     pyfile = args.script
+    try:
+        os.stat(pyfile)
+    except OSError:
+        raise SleuthNotFoundError('{0} could not be found.'.format(pyfile))
+
     sys.argv[:] = [pyfile] + args.args
     sys.path[0] = os.path.dirname(os.path.realpath(pyfile))
     config = args.config if args.config else _find_config()
 
-    if not os.path.exists(pyfile):
-        raise SleuthNotFoundError('{0} could not be found.'.format(pyfile))
-
     _run(config, pyfile, args.preserve)
 
 
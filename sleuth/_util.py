@@ -1,23 +1,172 @@
+import hashlib
+import importlib
+import importlib.util
+import io
+import marshal
+import os
 import sys
+import tempfile
 import types
+from functools import lru_cache
+from string import Formatter
+
+
+# Code objects compiled by compile_(), keyed by (filename, source)
+_code_cache = {}
+
+
+def compile_(source, filename):
+    """
+    Compile source code for execution, reusing the code object from an
+    earlier compilation of the same source in this or a previous run.
+    """
+
+    key = (filename, source)
+    code = _code_cache.get(key)
+    if code is None:
+        code = _load_code(filename, source)
+        _code_cache[key] = code
+    return code
+
+
+# The most code objects kept in the on-disk cache. The least recently
+# written are removed first.
+_MAX_CACHED_CODE = 128
+
+
+def _cache_dir():
+    """
+    Get the directory of the on-disk code cache, which follows the XDG
+    base directory specification.
+    """
+
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'sleuth')
+
+
+def _load_code(filename, source):
+    """
+    Get the code object for source code from the on-disk cache, compiling
+    and caching it if it is not there. The cache is only an optimization,
+    so any failure to use it falls back to compiling the source. Like
+    .pyc files, it is not used when sys.dont_write_bytecode is set, e.g.
+    by python -B or PYTHONDONTWRITEBYTECODE.
+    """
+
+    if sys.dont_write_bytecode:
+        return compile(source, filename, 'exec')
+
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    # The optimization level is part of the key, as in the names of .pyc
+    # files, since -O and -OO change the compiled code
+    digest = hashlib.sha1(importlib.util.MAGIC_NUMBER +
+                          bytes([sys.flags.optimize]) +
+                          os.fsencode(filename) + b'\0' + source).hexdigest()
+    cache_path = os.path.join(_cache_dir(), digest + '.pyc')
+
+    try:
+        with open(cache_path, 'rb') as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    code = compile(source, filename, 'exec')
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(code, f)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        _evict(os.path.dirname(cache_path))
+    except OSError:
+        pass
+    return code
+
+
+def _evict(cache_dir):
+    """
+    Remove the oldest code objects from the on-disk cache until it holds
+    no more than _MAX_CACHED_CODE of them.
+    """
+
+    entries = [entry for entry in os.scandir(cache_dir)
+               if entry.name.endswith('.pyc')]
+    if len(entries) <= _MAX_CACHED_CODE:
+        return
+
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - _MAX_CACHED_CODE]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+def read_source(path):
+    """
+    Read the contents of a source file as bytes, sizing the first read
+    by the size of the file. Pipes and other files which report a size
+    of 0 are read in chunks until their end.
+    """
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        chunks = [os.read(fd, max(size + 1, io.DEFAULT_BUFFER_SIZE))]
+        while chunks[-1]:
+            chunks.append(os.read(fd, io.DEFAULT_BUFFER_SIZE))
+    finally:
+        os.close(fd)
+    return b''.join(chunks)
+
+
+def field_names(fmtStr):
+    """
+    Get the names of the variables referenced by the replacement fields
+    of a format string, e.g. ('a', 'b') for '{a.real} {b[0]:>{a}}'.
+    """
+    names = []
+    for literal, field, spec, conversion in Formatter().parse(fmtStr):
+        if field:
+            names.append(field.partition('.')[0].partition('[')[0])
+        if spec:
+            names.extend(field_names(spec))
+    return tuple(sorted(set(names)))
 
 
 def import_(module):
-    if isinstance(module, types.ModuleType):
+    # Debuggers are usually given by name, so check for a string first
+    if isinstance(module, str):
+        return _import_name(module)
+    elif isinstance(module, types.ModuleType):
         return module
-    elif isinstance(module, str):
-        major, minor, *junk = sys.version_info
-        if major >= 3 and minor >= 1:
-            import importlib
-            return importlib.import_module(module)
-        else:
-            return __import__(module)
     else:
         raise ImportError
 
 
-def set_trace(frame, debugger):
+@lru_cache(maxsize=None)
+def _import_name(name):
+    return importlib.import_module(name)
+
+
+def make_tracer(debugger):
+    """
+    Get a function which breaks into a debugger in a given frame. A new
+    Pdb is made for each break, so that it uses the streams of the time
+    of the break rather than those of the time the tracer was made.
+    """
     if debugger.__name__ == 'pdb':
-        debugger.Pdb().set_trace(frame)
+        return lambda frame: debugger.Pdb().set_trace(frame)
     else:
-        debugger.set_trace(frame)
+        return debugger.set_trace
+
+
+def set_trace(frame, debugger):
+    make_tracer(debugger)(frame)
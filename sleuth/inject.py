@@ -1,9 +1,12 @@
+import ast
+import atexit
 import logging
-import os.path
+import os
 import sys
-from collections import defaultdict
+from functools import lru_cache
 
-from ._util import import_, set_trace
+from .error import SleuthError
+from ._util import field_names, import_, set_trace
 
 
 __all__ = ['break_at', 'print_at', 'log_at', 'call_at', 'comment_at',
@@ -51,9 +54,39 @@ def comment_at(filename, start, end=None, indent=None):
         _injector.comment(filename, lineno)
 
 
-def _getframe():
-    """Get the execution frame of the caller."""
-    return sys._getframe().f_back
+def _read_lines(filename):
+    """
+    Read the lines of a file, reusing the lines read previously if the
+    file has not changed since.
+    """
+
+    stat = os.stat(filename)
+    return _read_lines_cached(filename, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=32)
+def _read_lines_cached(filename, mtime, size):
+    with open(filename, 'r') as f:
+        return tuple(f)
+
+
+def _select_vars(frame, names):
+    """
+    Get the values of the given variables in an execution frame, looking
+    in its locals before its globals. Names which are not found are left
+    out.
+    """
+    # Reading f_locals may copy all of the frame's fast locals into a dict,
+    # so it is only read once
+    locals_ = frame.f_locals
+    globals_ = frame.f_globals
+    vars_ = {}
+    for name in names:
+        if name in locals_:
+            vars_[name] = locals_[name]
+        elif name in globals_:
+            vars_[name] = globals_[name]
+    return vars_
 
 
 class _Action:
@@ -84,17 +117,21 @@ class _Print(_Action):
     def __init__(self, fmtStr, file=None):
         super().__init__()
         self._fmtStr = fmtStr
+        self._fields = field_names(fmtStr)
         self._file = file if file is not None else sys.stdout
 
+        # The stream printed to. A file given by name is opened when it is
+        # first printed to and is then kept open until exit.
+        self._stream = None if type(self._file) is str else self._file
+
     def __call__(self, frame):
-        vars_ = frame.f_globals
-        vars_.update(frame.f_locals)
+        vars_ = _select_vars(frame, self._fields)
 
-        if type(self._file) is str:
-            with open(self._file, 'a') as f:
-                print(self._fmtStr.format(**vars_), file=f)
-        else:
-            print(self._fmtStr.format(**vars_), file=self._file)
+        if self._stream is None:
+            self._stream = open(self._file, 'a', buffering=1)
+            atexit.register(self._stream.close)
+
+        print(self._fmtStr.format_map(vars_), file=self._stream)
 
 
 class _Log(_Action):
@@ -107,15 +144,25 @@ class _Log(_Action):
         self._level = level
         self._logName = logName
 
+        # Loggers by log name. The frame's __name__ is needed for the default
+        # log name.
+        self._loggers = {}
+        self._fields = field_names(fmtStr)
+        if logName is None:
+            self._fields += ('__name__',)
+
     def __call__(self, frame):
-        vars_ = frame.f_globals
-        vars_.update(frame.f_locals)
+        vars_ = _select_vars(frame, self._fields)
 
         logName = (self._logName if self._logName is not None
                    else vars_['__name__'])
-        logger = logging.getLogger(logName)
-        logMsg = self._fmtStr.format(**vars_)
-        logger.log(self._level, logMsg)
+        logger = self._loggers.get(logName)
+        if logger is None:
+            logger = self._loggers[logName] = logging.getLogger(logName)
+
+        if logger.isEnabledFor(self._level):
+            logMsg = self._fmtStr.format_map(vars_)
+            logger.log(self._level, logMsg)
 
 
 class _Call(_Action):
@@ -126,13 +173,13 @@ class _Call(_Action):
         super().__init__()
         self._func = func
         self._args = args
-        self._kwargs = kwargs
+        self._kwargs = tuple(kwargs.items())
+        self._names = args + tuple(kwargs.values())
 
     def __call__(self, frame):
-        vars_ = frame.f_globals
-        vars_.update(frame.f_locals)
+        vars_ = _select_vars(frame, self._names)
         args = [vars_[arg] for arg in self._args]
-        kwargs = {key: vars_[val] for key, val in self._kwargs.items()}
+        kwargs = {key: vars_[val] for key, val in self._kwargs}
         self._func(*args, **kwargs)
 
 
@@ -152,20 +199,102 @@ class _Inject(_Action):
         exec(self._code, frame.f_globals, frame.f_locals)
 
 
+# The global name by which code modified by _Injector.inject_hooks() calls
+# _Injector.hook()
+_HOOK_NAME = '__sleuth_hook__'
+
+
+class _HookInserter(ast.NodeVisitor):
+    """
+    Insert calls to _Injector.hook() for a set of lines into an abstract
+    syntax tree. The hook for a line is called before the first statement
+    on or after that line, e.g. the statement following a commented line.
+    """
+    def __init__(self, filename, lines):
+        self._filename = filename
+        self._lines = set(lines)
+
+    def insert(self, tree):
+        """
+        Insert the hooks into a tree. A SleuthError is raised for lines
+        which can't be hooked, i.e. continuation lines of statements and
+        lines after the last statement of a body.
+        """
+
+        self.visit(tree)
+        if self._lines:
+            lines = ', '.join(str(line) for line in sorted(self._lines))
+            raise SleuthError("Actions can't be injected at line(s) {0} of "
+                              "'{1}', since no statement of their block "
+                              "starts on or after them."
+                              .format(lines, self._filename))
+        return tree
+
+    def generic_visit(self, node):
+        # Bodies are visited before the statements in them, so a line holding
+        # a compound statement is hooked before the statement as a whole.
+        # Only lines after the start of the node, and after any earlier body
+        # or exception handlers of the node, are hooked in a body. The header
+        # line of a handler or case is hooked at the start of its body.
+        if isinstance(node, ast.match_case):
+            end = node.pattern.lineno - 1
+        elif isinstance(node, ast.excepthandler):
+            end = node.lineno - 1
+        else:
+            end = getattr(node, 'lineno', 0)
+
+        for field, value in ast.iter_fields(node):
+            if (isinstance(value, list) and value and
+                    isinstance(value[0], (ast.stmt, ast.excepthandler))):
+                if isinstance(value[0], ast.stmt):
+                    setattr(node, field, self._insert_hooks(value, end))
+                end = value[-1].end_lineno
+
+        super().generic_visit(node)
+
+    def _insert_hooks(self, body, end):
+        new_body = []
+        # Lines within a statement are left for the bodies nested in it
+        for stmt in body:
+            lines = sorted(line for line in self._lines
+                           if end < line <= stmt.lineno)
+            for line in lines:
+                self._lines.remove(line)
+                new_body.append(self._make_hook(line, stmt))
+            new_body.append(stmt)
+            end = stmt.end_lineno
+        return new_body
+
+    def _make_hook(self, line, stmt):
+        source = '{0}({1!r}, {2})'.format(_HOOK_NAME, self._filename, line)
+        hook = ast.parse(source).body[0]
+        # Every node of the hook is moved, since the frame's line number
+        # while the hook runs comes from the call rather than the statement
+        for node in ast.walk(hook):
+            ast.copy_location(node, stmt)
+        return hook
+
+
 class _Injector:
     """Class to store, manage, and execute injection actions."""
     def __init__(self):
-        # self._actions[filename][line] -> [statement_1, ..., statement_n]
-        self._actions = defaultdict(lambda: defaultdict(list))
-        self._commented = set()
+        # self._actions[(filename, line)] -> (statement_1, ..., statement_n)
+        self._actions = {}
+        # self._commented[filename] -> {line_1, ..., line_n}
+        self._commented = {}
 
         self._enabled = False
 
     def add(self, filename, line, action):
-        self._actions[filename][line].append(action)
+        filename = os.path.realpath(filename)
+        # Actions are added rarely but run on every hit of their line, so
+        # they are stored in tuples rather than lists
+        key = (filename, line)
+        self._actions[key] = self._actions.get(key, ()) + (action,)
 
     def comment(self, filename, line):
-        self._commented.add((filename, line))
+        filename = os.path.realpath(filename)
+        self._commented.setdefault(filename, set()).add(line)
 
     def enable(self):
         self._enabled = True
@@ -174,31 +303,53 @@ class _Injector:
         self._enabled = False
 
     def inject_hooks(self, filename):
-        modified_file = ''
-        actions = self._actions[filename]
-        with open(filename, 'r') as f:
-            for lineno, line in enumerate(f, start=1):
-                indent_len = len(line) - len(line.lstrip())
-                indent = line[0: indent_len]
-
-                if (filename, lineno) in self._commented:
-                    line = indent + '# ' + line.lstrip()
-
-                if lineno in actions:
-                    injection = indent
-                    injection += 'import sleuth.inject; '
-                    injection += ('sleuth.inject._injector.hook("{0}", {1}, '
-                                  'sleuth.inject._getframe()); '
-                                  .format(filename, lineno))
-                    modified_file += injection
-                modified_file += line
-
-        return modified_file
-
-    def hook(self, filename, lineno, frame):
-        if self._enabled:
-            for action in self._actions[filename][lineno]:
-                action(frame)
+        """
+        Get the abstract syntax tree of a Python file, with its commented
+        lines commented out and a call to hook() inserted before the
+        statement on each line which has actions.
+        """
+
+        # Files are identified by their real paths, which are resolved once
+        # here rather than every time a hook is called
+        filename = os.path.realpath(filename)
+        lines = _read_lines(filename)
+
+        commented = self._commented.get(filename)
+        if commented:
+            lines = list(lines)
+            for lineno in commented:
+                if 0 < lineno <= len(lines):
+                    line = lines[lineno - 1]
+                    indent_len = len(line) - len(line.lstrip())
+                    lines[lineno - 1] = (line[0: indent_len] + '# ' +
+                                         line.lstrip())
+
+        tree = ast.parse(''.join(lines), filename)
+
+        hooked_lines = set(lineno for name, lineno in self._actions
+                           if name == filename)
+        if hooked_lines:
+            _HookInserter(filename, hooked_lines).insert(tree)
+            ast.fix_missing_locations(tree)
+
+        return tree
+
+    def hook_globals(self):
+        """
+        Get the global variables needed to execute code returned by
+        inject_hooks().
+        """
+        return {_HOOK_NAME: self.hook}
+
+    def hook(self, filename, lineno, frame=None):
+        if not self._enabled:
+            return
+
+        if frame is None:
+            frame = sys._getframe(1)
+
+        for action in self._actions.get((filename, lineno), ()):
+            action(frame)
 
 
 # The global _Injector instance. This should be accessed by clients via the
@@ -1,12 +1,14 @@
+import collections
+import inspect
+import itertools
 import logging
 import sys
+import time
 import types
+import weakref
 
-from functools import wraps
-from functools import partial
-
-from .error import SleuthError, SleuthNotFoundError
-from ._util import import_, set_trace
+from .error import SleuthNotFoundError
+from ._util import field_names, import_, make_tracer
 
 
 __all__ = ['breakOnEnter', 'breakOnException', 'breakOnExit', 'breakOnResult',
@@ -14,28 +16,89 @@ __all__ = ['breakOnEnter', 'breakOnException', 'breakOnExit', 'breakOnResult',
            'logCalls', 'logOnException', 'skip', 'substitute', 'tap']
 
 
-def logCalls(func=None, *, enterFmtStr=None, exitFmtStr=None,
+# The types of objects searched by _search()
+_SEARCHABLE = (type, types.ModuleType, types.FunctionType)
+
+
+def _kw_decorator(build):
+    """
+    Make a Sleuth function wrapper from a function which builds a
+    wrapper for a given function. The resulting function wrapper can be
+    applied either directly or with keyword arguments only, e.g. both
+    logCalls(func) and logCalls(level=logging.INFO)(func) are valid.
+    """
+
+    def decorator(func=None, **kwargs):
+        if func is None:
+            return lambda func: build(func, **kwargs)
+        return build(func, **kwargs)
+    return _wrap(decorator, build)
+
+
+def _exceptions(exceptionList):
+    """
+    Get what an except clause should catch for an exceptionList, which
+    may be an exception or any iterable of exceptions. A single exception
+    is caught on its own rather than in a one-item tuple.
+    """
+    if isinstance(exceptionList, type):
+        return exceptionList
+
+    exceptions = tuple(exceptionList)
+    return exceptions[0] if len(exceptions) == 1 else exceptions
+
+
+# The attributes copied from a wrapped function to its wrapper by _wrap()
+_WRAPPER_ASSIGNMENTS = ('__module__', '__name__', '__qualname__', '__doc__',
+                        '__annotations__')
+
+
+def _wrap(wrapper, func):
+    """
+    Make a wrapper function look like the function it wraps.
+
+    This is a lighter version of functools.update_wrapper() which only
+    copies the attributes Sleuth relies on. As with update_wrapper(),
+    attributes which the wrapped callable lacks are skipped.
+    """
+
+    for attr in _WRAPPER_ASSIGNMENTS:
+        try:
+            value = getattr(func, attr)
+        except AttributeError:
+            pass
+        else:
+            setattr(wrapper, attr, value)
+    wrapper.__dict__.update(getattr(func, '__dict__', {}))
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+@_kw_decorator
+def logCalls(func, *, enterFmtStr=None, exitFmtStr=None,
              level=logging.DEBUG, logName=None, timerFunc=None):
     """
     A function wrapper that logs call information about a function.
 
     Logging is performed both when the wrapped function is entered and
     exited. By default, the call number, name, and total call time of
-    the function are logged.
+    the function are logged. If the log is not enabled for the given
+    level, the wrapped function is called without formatting or timing.
 
     Parameters
     ----------
     func : The function to wrap.
 
     enterFmtStr : A formatted string that is output when the wrapped
-        function is entered. The format() function is called on the
-        string with locals(). If not specified, this argument is set to
-        '[{callNumber}] Calling {funcName}()'.
+        function is entered. The string may refer to callNumber,
+        funcName, func, args, and kwargs. If not specified, this
+        argument is set to '[{callNumber}] Calling {funcName}()'.
 
     exitFmtStr : A formatted string that is output when the wrapped
-        function is exited. The format() function is called on the
-        string with locals(). If not specified, this argument is set to
-        '[{callNumber}] Exiting {funcName}()\t[{callTime} seconds]'.
+        function is exited. The string may refer to the same names as
+        enterFmtStr, as well as result and callTime, the unrounded
+        duration of the call. If not specified, this argument is set to
+        '[{callNumber}] Exiting {funcName}()\t[{callTime:.4f} seconds]'.
 
     level : The logging level used for logging calls. This must be one
         of the logging level constants defined in the logging module,
@@ -49,55 +112,60 @@ def logCalls(func=None, *, enterFmtStr=None, exitFmtStr=None,
         calls. This function is called before and after the wrapped
         function is called. The difference between the two return
         values of the timing function is used as the duration of the
-        function call. If not given, time.time is used.
+        function call. If not given, time.perf_counter is used.
     """
 
-    if func is None:
-        return partial(logCalls, enterFmtStr=enterFmtStr,
-                       exitFmtStr=exitFmtStr, level=level, logName=logName,
-                       timerFunc=timerFunc)
-
-    # The number of times the wrapped function has been called
-    nCalls = 0
+    # Counts the calls to the wrapped function
+    callCounter = itertools.count()
 
     if enterFmtStr is None:
         enterFmtStr = '[{callNumber}] Calling {funcName}()'
 
     if exitFmtStr is None:
-        exitFmtStr = ('[{callNumber}] Exiting {funcName}()\t[{callTime} '
+        exitFmtStr = ('[{callNumber}] Exiting {funcName}()\t[{callTime:.4f} '
                       'seconds]')
 
     if logName is None:
         logName = func.__module__
 
     if timerFunc is None:
-        import time
-        timerFunc = time.time
+        timerFunc = time.perf_counter
+
+    logger = logging.getLogger(logName)
+    funcName = func.__name__
+    # Calls are only timed if the exit message shows the call time
+    timed = 'callTime' in field_names(exitFmtStr)
 
-    @wraps(func)
     def wrapper(*args, **kwargs):
-        nonlocal nCalls
-        funcName = func.__name__
+        callNumber = next(callCounter)
 
-        callNumber = nCalls
-        logger = logging.getLogger(logName)
-        logMsg = enterFmtStr.format(**locals())
-        logger.log(level, logMsg)
-        nCalls = nCalls + 1
+        if not logger.isEnabledFor(level):
+            # Nothing would be logged, so skip formatting and timing
+            return func(*args, **kwargs)
 
-        start = timerFunc()
-        result = func(*args, **kwargs)
-        end = timerFunc()
+        logMsg = enterFmtStr.format(callNumber=callNumber, funcName=funcName,
+                                    func=func, args=args, kwargs=kwargs)
+        logger.log(level, logMsg)
 
-        callTime = round(end - start, 4)  # TODO: use string formatting instead
-        logMsg = exitFmtStr.format(**locals())
+        if timed:
+            start = timerFunc()
+            result = func(*args, **kwargs)
+            callTime = timerFunc() - start
+        else:
+            result = func(*args, **kwargs)
+            callTime = None
+
+        logMsg = exitFmtStr.format(callNumber=callNumber, funcName=funcName,
+                                   func=func, args=args, kwargs=kwargs,
+                                   result=result, callTime=callTime)
         logger.log(level, logMsg)
 
         return result
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def logOnException(func=None, *, exceptionList=Exception, suppress=False,
+@_kw_decorator
+def logOnException(func, *, exceptionList=Exception, suppress=False,
                    fmtStr=None, level=logging.DEBUG, logName=None):
     """
     A function wrapper that logs information when an exception is
@@ -114,7 +182,8 @@ def logOnException(func=None, *, exceptionList=Exception, suppress=False,
         applies to exceptions specified in exceptionList.
 
     fmtStr : A formatted string that is output when the wrapped
-        function raises a specified exception.
+        function raises a specified exception. The string may refer to
+        funcName, func, args, kwargs, exception, and exceptionType.
 
     level : The logging level used for logging calls. This must be one
         of the logging level constants defined in the logging module,
@@ -125,11 +194,6 @@ def logOnException(func=None, *, exceptionList=Exception, suppress=False,
         function is defined is used, i.e. func.__module__.
     """
 
-    if func is None:
-        return partial(logOnException, exceptionList=exceptionList,
-                       suppress=suppress, fmtStr=fmtStr, level=level,
-                       logName=logName)
-
     if fmtStr is None:
         fmtStr = ("Exception raised in {funcName}(): '{exceptionType}: "
                   "{exception}'")
@@ -137,23 +201,29 @@ def logOnException(func=None, *, exceptionList=Exception, suppress=False,
     if logName is None:
         logName = func.__module__
 
-    @wraps(func)
+    logger = logging.getLogger(logName)
+    funcName = func.__name__
+    exceptionList = _exceptions(exceptionList)
+
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
         except exceptionList as exception:
-            exceptionType = exception.__class__.__name__
-            funcName = func.__name__
-            logger = logging.getLogger(logName)
-            logMsg = fmtStr.format(**locals())
-            logger.log(level, logMsg)
+            if logger.isEnabledFor(level):
+                exceptionType = type(exception).__name__
+                logMsg = fmtStr.format(funcName=funcName, func=func,
+                                       args=args, kwargs=kwargs,
+                                       exception=exception,
+                                       exceptionType=exceptionType)
+                logger.log(level, logMsg)
 
             if not suppress:
                 raise
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def breakOnEnter(func=None, *, debugger='pdb'):
+@_kw_decorator
+def breakOnEnter(func, *, debugger='pdb'):
     """
     A function wrapper that causes debug mode to be entered when the
     wrapped function is called.
@@ -168,18 +238,18 @@ def breakOnEnter(func=None, *, debugger='pdb'):
         supported.
     """
 
-    if func is None:
-        return partial(breakOnEnter, debugger=debugger)
+    # A plain function is used as the wrapper rather than a partial of
+    # runcall, because a partial does not bind as a method when the
+    # wrapped function is tapped within a class.
+    runcall = import_(debugger).runcall
 
-    debugger = import_(debugger)
-
-    @wraps(func)
     def wrapper(*args, **kwargs):
-        return debugger.runcall(func, *args, **kwargs)
-    return wrapper
+        return runcall(func, *args, **kwargs)
+    return _wrap(wrapper, func)
 
 
-def breakOnExit(func=None, *, debugger='pdb'):
+@_kw_decorator
+def breakOnExit(func, *, debugger='pdb'):
     """
     A function wrapper that causes debug mode to be entered when the
     wrapped function exits.
@@ -193,23 +263,20 @@ def breakOnExit(func=None, *, debugger='pdb'):
         the name of the debugging module. Currently, pdb and ipdb are
         supported.
     """
-    if func is None:
-        return partial(breakOnExit, debugger=debugger)
-
-    debugger = import_(debugger)
+    trace = make_tracer(import_(debugger))
 
-    @wraps(func)
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
 
-        debug_frame = sys._getframe().f_back
-        set_trace(debug_frame, debugger)
+        debug_frame = sys._getframe(1)
+        trace(debug_frame)
 
         return result
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def breakOnResult(func=None, *, compare=None, debugger='pdb'):
+@_kw_decorator
+def breakOnResult(func, *, compare=None, debugger='pdb'):
     """
     A function wrapper that causes debug mode to be entered when the
     wrapped function returns a certain result.
@@ -229,24 +296,22 @@ def breakOnResult(func=None, *, compare=None, debugger='pdb'):
         supported.
     """
 
-    if func is None:
-        return partial(breakOnResult, compare=compare, debugger=debugger)
-
-    debugger = import_(debugger)
+    trace = make_tracer(import_(debugger))
 
-    @wraps(func)
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
 
         if compare(result):
-            debug_frame = sys._getframe().f_back
-            set_trace(debug_frame, debugger)
+            debug_frame = sys._getframe(1)
+            trace(debug_frame)
 
         return result
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def breakOnException(func=None, *, exceptionList=Exception, debugger='pdb'):
+@_kw_decorator
+def breakOnException(func, *, exceptionList=Exception, suppress=False,
+                     debugger='pdb'):
     """
     A function wrapper that causes debug mode to be entered when the
     wrapped function throws a specified exception.
@@ -257,29 +322,34 @@ def breakOnException(func=None, *, exceptionList=Exception, debugger='pdb'):
 
     exceptionList : An exception or tuple of exceptions to break on.
 
+    suppress : A boolean indicating whether a caught exception should
+        be suppressed after debug mode is left. If False, the exception
+        is reraised. This only applies to exceptions specified in
+        exceptionList.
+
     debugger : The debugger used when debug mode is entered. This can
         be either the debugging module itself or a string containing
         the name of the debugging module. Currently, pdb and ipdb are
         supported.
     """
 
-    if func is None:
-        return partial(breakOnException, exceptionList=exceptionList,
-                       debugger=debugger)
+    trace = make_tracer(import_(debugger))
+    exceptionList = _exceptions(exceptionList)
 
-    debugger = import_(debugger)
-
-    @wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
-        except exceptionList as e:
-            debug_frame = sys._getframe().f_back
-            set_trace(debug_frame, debugger)
-    return wrapper
+        except exceptionList:
+            debug_frame = sys._getframe(1)
+            trace(debug_frame)
 
+            if not suppress:
+                raise
+    return _wrap(wrapper, func)
 
-def callOnEnter(func=None, *, callback=None):
+
+@_kw_decorator
+def callOnEnter(func, *, callback=None):
     """
     A function wrapper that calls a callback function before the
     wrapped function is called.
@@ -293,17 +363,14 @@ def callOnEnter(func=None, *, callback=None):
         the same arguments passed to the wrapped function.
     """
 
-    if func is None:
-        return partial(callOnEnter, callback=callback)
-
-    @wraps(func)
     def wrapper(*args, **kwargs):
         callback(func, *args, **kwargs)  # TODO: add attribute for retval?
         return func(*args, **kwargs)
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def callOnExit(func=None, *, callback=None):
+@_kw_decorator
+def callOnExit(func, *, callback=None):
     """
     A function wrapper that calls a callback function after the wrapped
     function is called.
@@ -318,17 +385,14 @@ def callOnExit(func=None, *, callback=None):
         ultimately returned to the caller of the wrapped function.
     """
 
-    if func is None:
-        return partial(callOnExit, callback=callback)
-
-    @wraps(func)
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
         return callback(func, result)
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def callOnResult(func=None, *, compare=None, callback=None):
+@_kw_decorator
+def callOnResult(func, *, compare=None, callback=None):
     """
     A function wrapper that calls a callback function when the wrapped
     function returns a certain result.
@@ -349,10 +413,6 @@ def callOnResult(func=None, *, compare=None, callback=None):
         the caller of the wrapped function.
     """
 
-    if func is None:
-        return partial(callOnResult, compare=compare, callback=callback)
-
-    @wraps(func)
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
 
@@ -360,10 +420,11 @@ def callOnResult(func=None, *, compare=None, callback=None):
             result = callback(func, result)
 
         return result
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def callOnException(func=None, *, exceptionList=Exception, callback=None):
+@_kw_decorator
+def callOnException(func, *, exceptionList=Exception, callback=None):
     """
     A function wrapper that calls a callback function when the wrapped
     function throws a specified exception.
@@ -372,8 +433,8 @@ def callOnException(func=None, *, exceptionList=Exception, callback=None):
     ----------
     func : The function to wrap.
 
-    exceptionList : A tuple of exceptions on which to call the callback
-        function.
+    exceptionList : An exception or tuple of exceptions on which to
+        call the callback function.
 
     callback : The callback function to call. This function is called
         with the wrapped function and the exception thrown by the
@@ -384,21 +445,19 @@ def callOnException(func=None, *, exceptionList=Exception, callback=None):
         callback function returns no value.
     """
 
-    if func is None:
-        return partial(callOnException, exceptionList=exceptionList,
-                       callback=callback)
+    exceptionList = _exceptions(exceptionList)
 
-    @wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
         except exceptionList as e:
             if not callback(func, e):
                 raise
-    return wrapper
+    return _wrap(wrapper, func)
 
 
-def skip(func=None, *, returnValue=None):
+@_kw_decorator
+def skip(func, *, returnValue=None):
     """
     A function wrapper that causes the call to the wrapped function to
     be skipped.
@@ -412,16 +471,58 @@ def skip(func=None, *, returnValue=None):
         default.
     """
 
-    if func is None:
-        return partial(skip, returnValue=returnValue)
+    wrapper = _make_skipper(func, returnValue)
+    if wrapper is None:
+        def wrapper(*args, **kwargs):
+            return returnValue
+    return _wrap(wrapper, func)
 
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        return returnValue
+
+def _make_skipper(func, returnValue):
+    """
+    Make a function with the same parameters as func which returns
+    returnValue, so that calls to it need not pack their arguments.
+    None is returned if func is not a plain Python function, e.g. for a
+    bound method, whose parameters include the instance it is bound to.
+    """
+
+    if not isinstance(func, types.FunctionType):
+        return None
+
+    code = func.__code__
+    names = code.co_varnames
+    nArgs = code.co_argcount
+    nKwargs = code.co_kwonlyargcount
+    params = list(names[:nArgs])
+    if code.co_posonlyargcount:
+        params.insert(code.co_posonlyargcount, '/')
+
+    i = nArgs + nKwargs
+    if code.co_flags & inspect.CO_VARARGS:
+        params.append('*' + names[i])
+        i += 1
+    elif nKwargs:
+        params.append('*')
+    params.extend(names[nArgs:nArgs + nKwargs])
+    if code.co_flags & inspect.CO_VARKEYWORDS:
+        params.append('**' + names[i])
+        i += 1
+
+    if '_returnValue' in names[:i]:
+        return None
+
+    namespace = {'_returnValue': returnValue}
+    source = 'def wrapper({0}):\n    return _returnValue'.format(
+        ', '.join(params))
+    exec(source, namespace)
+    wrapper = namespace['wrapper']
+    wrapper.__defaults__ = func.__defaults__
+    wrapper.__kwdefaults__ = func.__kwdefaults__
     return wrapper
 
 
-def substitute(func=None, *, replacement=None):
+@_kw_decorator
+def substitute(func, *, replacement=None):
     """
     A function wrapper that substitutes calls to the wrapped function
     with calls to a replacement funciton.
@@ -435,13 +536,9 @@ def substitute(func=None, *, replacement=None):
         arguments as would be passed to the wrapped function.
     """
 
-    if func is None:
-        return partial(substitute, replacement=replacement)
-
-    @wraps(func)
     def wrapper(*args, **kwargs):
         return replacement(*args, **kwargs)
-    return wrapper
+    return _wrap(wrapper, func)
 
 
 def tap(func, wrapper, *args, **kwargs):
@@ -458,25 +555,80 @@ def tap(func, wrapper, *args, **kwargs):
         passed to wrapper.
     """
 
-    try:
-        module = sys.modules[func.__module__]
-    except (KeyError, AttributeError):
+    module = sys.modules.get(getattr(func, '__module__', None))
+    if module is None:
         raise SleuthNotFoundError("The module containing function '{0}' could "
                                   "not be found.".format(func.__name__))
 
     wrapped = wrapper(*args, **kwargs)(func)
     parent = _get_parent_scope(func, module)
     setattr(parent, func.__name__, wrapped)
+    _children_cache.pop(parent, None)
     # TODO: is func.__name__ always correct?
 
 
+# Weak references to the parent scopes found by _get_parent_scope(). Modules
+# are held weakly too, so that reloaded modules and their classes can be
+# collected.
+# _parent_cache[module][func.__qualname__] -> weakref to parent
+_parent_cache = weakref.WeakKeyDictionary()
+
+
 def _get_parent_scope(func, module):
     """
     Obtain the parent scope of a function given the module in which it
     is defined.
     """
 
-    path = _search(func, module, limit=100)
+    # Functions defined at the top level of their module are the common
+    # case, and need neither the cache nor a search
+    if _holds(module, func):
+        return module
+
+    try:
+        parents = _parent_cache.setdefault(module, {})
+    except TypeError:
+        # The module can't be weakly referenced
+        parents = {}
+
+    ref = parents.get(func.__qualname__)
+    parent = ref() if ref is not None else None
+    if parent is not None and _holds(parent, func):
+        return parent
+
+    parent = _find_parent_scope(func, module)
+    try:
+        parents[func.__qualname__] = weakref.ref(parent)
+    except TypeError:
+        pass
+    return parent
+
+
+def _find_parent_scope(func, module):
+    """
+    Find the parent scope of a function given the module in which it is
+    defined.
+    """
+
+    # Follow the qualified name of the function, which avoids searching
+    # the module in the common case
+    parent = module
+    *scopes, name = func.__qualname__.split('.')
+    for scope in scopes:
+        if scope != '<locals>':
+            parent = getattr(parent, scope, None)
+
+    if parent is not None and _holds(parent, func):
+        return parent
+
+    path = _search(func, module, limit=100,
+                   package=_package_name(module))
+
+    if path is None:
+        # The cached children of some node may be out of date, or the
+        # function may only be held by objects from other packages
+        _children_cache.clear()
+        path = _search(func, module, limit=100)
 
     if path is not None:
         return path[-2]
@@ -486,12 +638,32 @@ def _get_parent_scope(func, module):
                                   .format(func.__name__, module.__name__))
 
 
-def _search(func, module, limit):
+def _holds(parent, func):
+    """
+    Determine whether a function, or a wrapper of it applied by tap(),
+    is an attribute of a parent scope.
+    """
+
+    attr = getattr(parent, func.__name__, None)
+    while attr is not None:
+        if attr is func:
+            return True
+        attr = getattr(attr, '__wrapped__', None)
+    return False
+
+
+def _search(func, module, limit, package=None):
     """
     Get the path of a function starting with the module in which it is
     defined; that is, the sequence of enclosing modules and classes
     that must be followed to reach the function from its module.
 
+    The search is a single breadth-first traversal of the module graph
+    in which each node is visited at most once, so the shortest path to
+    the function is found. If a package name is given, only modules and
+    classes from that top-level package are searched. A function is
+    usually held within its own package, so this is tried first.
+
     Returns
     -------
     A list of module and class objects which forms a path from the
@@ -501,48 +673,90 @@ def _search(func, module, limit):
         in the list is an attribute of the previous item.
     """
 
-    def search_helper(goal, node, path, depth, limit, seen):
-        # Cut off redundant searches
-        if node in seen:
-            return None
+    if module is func:
+        return [module]
 
-        # Cut off deep searches
-        if limit is not None and depth > limit:
-            return None
+    # parents[id(node)] -> (node, parent of node)
+    parents = {id(module): (module, None)}
+    queue = collections.deque([(module, 0)])
 
-        # Keep track of searched nodes and search path
-        seen.add(node)
-        path.append(node)
+    while queue:
+        node, depth = queue.popleft()
+        depth += 1
 
-        if node is goal:
-            return path
+        for child in _children(node):
+            # Cut off redundant searches
+            if id(child) in parents:
+                continue
 
-        for attr in dir(node):
-            try:
-                child = getattr(node, attr)
+            parents[id(child)] = (child, node)
 
-                # Only search modules, classes, and functions
-                if (isinstance(child, type) or
-                        isinstance(child, types.ModuleType) or
-                        isinstance(child, types.FunctionType)):
+            if child is func:
+                # Reconstruct the path by following parents back to the
+                # module
+                path = []
+                while child is not None:
+                    path.append(child)
+                    child = parents[id(child)][1]
+                path.reverse()
+                return path
 
-                    child_path = search_helper(goal, child, path, depth + 1,
-                                               limit, seen)
+            # Cut off deep searches and searches outside of the package
+            if ((limit is None or depth <= limit) and
+                    (package is None or _package_name(child) == package)):
+                queue.append((child, depth))
 
-                    if child_path is not None:
-                        return child_path
-            except AttributeError:
-                # Ignore attribute errors
-                pass
+    return None
 
-        # Solution path does not contain this node
-        path.pop()
-        return None
 
-    for i in range(1, limit):
-        path = search_helper(func, module, [], 0, i, set())
+def _package_name(node):
+    """Get the name of the top-level package in which a node is defined."""
+    if isinstance(node, types.ModuleType):
+        name = node.__name__
+    else:
+        name = getattr(node, '__module__', None)
+    return name.partition('.')[0] if isinstance(name, str) else None
 
-        if path is not None:
-            return path
 
-    return None
+# The children of nodes searched by _search(), keyed by node
+_children_cache = weakref.WeakKeyDictionary()
+
+
+def _children(node):
+    """
+    Get the attributes of a node which should be searched by _search(),
+    i.e. its modules, classes, and functions.
+
+    The children of a node are cached, since the attributes of modules
+    and classes rarely change between calls to tap().
+    """
+
+    try:
+        return _children_cache[node]
+    except KeyError:
+        children = _children_cache[node] = tuple(_find_children(node))
+        return children
+    except TypeError:
+        # The node cannot be used as a weak dictionary key
+        return tuple(_find_children(node))
+
+
+def _find_children(node):
+    """
+    Generate the attributes of a node which should be searched by
+    _search().
+
+    Only the attributes defined directly on modules and classes are
+    searched, which avoids the sorting and inherited attributes of
+    dir(). A function inherited by a class is found through the class
+    which defines it. Static methods are unwrapped to the functions they
+    hold, as getattr() would do.
+    """
+
+    if isinstance(node, (types.ModuleType, type)):
+        for child in vars(node).values():
+            if isinstance(child, staticmethod):
+                child = child.__func__
+            # Only search modules, classes, and functions
+            if isinstance(child, _SEARCHABLE):
+                yield child
@@ -1,11 +1,7 @@
+import sys
 from functools import partial
 from functools import wraps
 
-try:
-    from unittest.mock import MagicMock
-except ImportError:
-    from mock import MagicMock
-
 
 def doNothing(*args, **kwargs):
     '''
@@ -35,6 +31,34 @@ def raiseException(exception=None):
         raise Exception
 
 
+class FakeClass:
+    '''
+    A test class with a method that returns a value.
+    '''
+
+    def returnValue(self, return_value):
+        return return_value
+
+
+def makeNested():
+    '''
+    A test function that returns a nested function.
+    '''
+
+    def nested(return_value):
+        return return_value
+    return nested
+
+
+class FakeNamespace:
+    '''
+    A test class holding a function which cannot be found by its qualified
+    name.
+    '''
+
+    nested = makeNested()
+
+
 def decorator(func=None, **kwargs):
     '''
     A Sleuth-style decorator for testing purposes.
@@ -57,3 +81,24 @@ doNothing_callback.called = False
 def returnValue_callback(func, result):
     returnValue_callback.called = True
 returnValue_callback.called = False
+
+
+def reset():
+    '''
+    Undo the changes made to this module and its classes by tests, which is
+    much cheaper than reloading the module.
+    '''
+
+    for obj, attrs in _originals.items():
+        for name, value in attrs.items():
+            if vars(obj).get(name) is not value:
+                setattr(obj, name, value)
+
+    doNothing.called = False
+    doNothing_callback.called = False
+    returnValue_callback.called = False
+
+
+# The original attributes of this module and its classes, restored by reset()
+_originals = {obj: dict(vars(obj))
+              for obj in (sys.modules[__name__], FakeClass, FakeNamespace)}
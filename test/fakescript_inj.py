@@ -1,3 +1,8 @@
 if __name__ == '__main__':
     print('FIRST MESSAGE')
     print('SECOND MESSAGE')
+
+    def func():
+        return 1
+
+    func()
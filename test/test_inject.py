@@ -1,42 +1,66 @@
+import ast
 import logging
+import os
+import re
 import sys
+import tempfile
 import textwrap
 import unittest
+from importlib import reload
 from io import StringIO
-
-try:
-    from unittest.mock import MagicMock, mock_open, patch
-except ImportError:
-    from mock import MagicMock, mock_open, patch
-
-try:
-    from importlib import reload
-except ImportError:
-    from imp import reload
+from unittest.mock import MagicMock, mock_open, patch
 
 import sleuth.inject
-from sleuth.inject import (_Break, _Call, _Inject, _Log, _Print, break_at,
-                           call_at, comment_at, inject_at, log_at, print_at)
+from sleuth.inject import (_Break, _Call, _HookInserter, _Inject, _Log,
+                           _Print, break_at, call_at, comment_at, inject_at,
+                           log_at, print_at)
 
 import fakescript_inj
 
 
 class TestInjectionActions(unittest.TestCase):
-    def setUp(self):
-        reload(logging)
-        self.frame = self._get_test_frame()
-        self.test_str = 'INJECTION TEST'
-        self.fmt_str = '{message} {magic_number}'
-        self.log_name = 'testlog'
-        self.log = StringIO()
-        logging.basicConfig(level=logging.DEBUG, stream=self.log)
+    @classmethod
+    def setUpClass(cls):
+        cls.frame = cls._get_test_frame()
+        cls.frame_locals = dict(cls.frame.f_locals)
+        cls.test_str = 'INJECTION TEST'
+        cls.fmt_str = '{message} {magic_number}'
+        cls.expected_fmt_out = cls.fmt_str.format(**cls.frame_locals)
+        cls.log_name = 'testlog'
+        cls.log_name_re = re.compile(r'\S*{0}\S*{1}'.format(cls.log_name,
+                                                             cls.test_str))
+        cls.log = StringIO()
+
+        root = logging.getLogger()
+        cls._root_level = root.level
+        cls._handler = logging.StreamHandler(cls.log)
+        cls._handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.addHandler(cls._handler)
+        root.setLevel(logging.DEBUG)
+
+        # stdout is replaced for the whole class and emptied before each test
+        cls.stdout = StringIO()
+        cls._stdout_patcher = patch('sys.stdout', cls.stdout)
+        cls._stdout_patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._stdout_patcher.stop()
+        root = logging.getLogger()
+        root.removeHandler(cls._handler)
+        root.setLevel(cls._root_level)
+        cls.frame = None
+        cls.frame_locals = None
+        cls.log = None
+        cls.stdout = None
 
-    def tearDown(self):
-        self.log_name = None
-        self.log = None
-        logging = None
+    def setUp(self):
+        for stream in (self.log, self.stdout):
+            stream.seek(0)
+            stream.truncate()
 
-    def _get_test_frame(self):
+    @staticmethod
+    def _get_test_frame():
         """
         Return this function's execution frame object for testing purposes.
 
@@ -51,35 +75,47 @@ class TestInjectionActions(unittest.TestCase):
         return sys._getframe()
 
     def test_Print(self):
-        with patch('sys.stdout', new=StringIO()) as fake_stdout:
-            action = _Print(self.test_str)
-            action(self.frame)
+        action = _Print(self.test_str)
+        action(self.frame)
 
-            self.assertEqual(fake_stdout.getvalue().strip(), self.test_str)
+        self.assertEqual(self.stdout.getvalue().strip(), self.test_str)
 
     def test_Print_formatting(self):
-        with patch('sys.stdout', new=StringIO()) as fake_stdout:
-            action = _Print(self.fmt_str)
-            expected_out = self.fmt_str.format(**self.frame.f_locals)
-            action(self.frame)
+        action = _Print(self.fmt_str)
+        action(self.frame)
 
-            self.assertEqual(fake_stdout.getvalue().strip(), expected_out)
+        self.assertEqual(self.stdout.getvalue().strip(), self.expected_fmt_out)
 
     def test_Print_to_file(self):
         fake_open = mock_open(mock=MagicMock())
-        with patch('sleuth.inject.open', fake_open, create=True):
+        with patch.object(sleuth.inject, 'open', fake_open, create=True):
             action = _Print(self.fmt_str, file='junk.txt')
-            expected_out = self.fmt_str.format(**self.frame.f_locals)
             action(self.frame)
 
             fake_file = fake_open.return_value.__enter__.return_value
-            fake_file.write.assert_any_call(expected_out)
+            fake_file.write.assert_any_call(self.expected_fmt_out)
+
+    def test_Print_to_file_opened_once(self):
+        fake_open = mock_open(mock=MagicMock())
+        with patch.object(sleuth.inject, 'open', fake_open, create=True):
+            action = _Print(self.fmt_str, file='junk.txt')
+            action(self.frame)
+            action(self.frame)
+
+            fake_open.assert_called_once_with('junk.txt', 'a', buffering=1)
+
+    def test_Print_globals_unchanged(self):
+        action = _Print(self.fmt_str)
+        action(self.frame)
+
+        self.assertNotIn('message', self.frame.f_globals)
+        self.assertNotIn('magic_number', self.frame.f_globals)
 
     def test_Call(self):
         func = MagicMock()
         action = _Call(func, 'message', kwarg='magic_number')
-        message = self.frame.f_locals['message']
-        magic_number = self.frame.f_locals['magic_number']
+        message = self.frame_locals['message']
+        magic_number = self.frame_locals['magic_number']
         action(self.frame)
 
         func.assert_called_once_with(message, kwarg=magic_number)
@@ -88,24 +124,22 @@ class TestInjectionActions(unittest.TestCase):
         action = _Log(self.test_str)
         action(self.frame)
 
-        self.assertRegex(self.log.getvalue(), self.test_str)
+        self.assertIn(self.test_str, self.log.getvalue())
 
     def test_Log_formatting(self):
         action = _Log(self.fmt_str)
-        expected_out = self.fmt_str.format(**self.frame.f_locals)
         action(self.frame)
 
-        self.assertRegex(self.log.getvalue(), expected_out)
+        self.assertIn(self.expected_fmt_out, self.log.getvalue())
 
     def test_Log_with_logName(self):
         action = _Log(self.test_str, logName=self.log_name)
-        expected_out = '\S*{0}\S*{1}'.format(self.log_name, self.test_str)
         action(self.frame)
 
-        self.assertRegex(self.log.getvalue(), expected_out)
+        self.assertRegex(self.log.getvalue(), self.log_name_re)
 
     def test_Break(self):
-        with patch('sleuth.inject.set_trace', MagicMock()) as fake_set_trace:
+        with patch.object(sleuth.inject, 'set_trace') as fake_set_trace:
             action = _Break()
             action(self.frame)
 
@@ -113,7 +147,7 @@ class TestInjectionActions(unittest.TestCase):
             fake_set_trace.assert_called_once_with(self.frame, pdb)
 
     def test_Break_ipdb(self):
-        with patch('sleuth.inject.set_trace', MagicMock()) as fake_set_trace:
+        with patch.object(sleuth.inject, 'set_trace') as fake_set_trace:
             action = _Break(debugger='ipdb')
             action(self.frame)
 
@@ -121,34 +155,55 @@ class TestInjectionActions(unittest.TestCase):
             fake_set_trace.assert_called_once_with(self.frame, ipdb)
 
     def test_Inject(self):
-        with patch('sys.stdout', new=StringIO()) as fake_stdout:
-            code = 'print("{0}")'.format(self.test_str)
-            action = _Inject(code)
-            action(self.frame)
+        code = 'print("{0}")'.format(self.test_str)
+        action = _Inject(code)
+        action(self.frame)
 
-            self.assertEqual(fake_stdout.getvalue().strip(), self.test_str)
+        self.assertEqual(self.stdout.getvalue().strip(), self.test_str)
 
     def test_Inject_multiline(self):
-        with patch('sys.stdout', new=StringIO()) as fake_stdout:
-            lines_to_print = 3
-            code = """\
-                   for i in range({0}):
-                       print("{1}", i)
-                   """.format(lines_to_print, self.test_str)
-            code = textwrap.dedent(code)
-            action = _Inject(code)
-            action(self.frame)
+        lines_to_print = 3
+        code = """\
+               for i in range({0}):
+                   print("{1}", i)
+               """.format(lines_to_print, self.test_str)
+        code = textwrap.dedent(code)
+        action = _Inject(code)
+        action(self.frame)
 
-            fake_stdout.seek(0)
-            for i in range(lines_to_print):
-                line = fake_stdout.readline()
-                self.assertEqual(line.strip(), '{0} {1}'.format(self.test_str,
-                                                                i))
+        self.stdout.seek(0)
+        for i in range(lines_to_print):
+            line = self.stdout.readline()
+            self.assertEqual(line.strip(), '{0} {1}'.format(self.test_str,
+                                                            i))
 
 
 class TestInjectionFunctions(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # stdout is replaced for the whole class and emptied before each test
+        cls.stdout = StringIO()
+        cls._stdout_patcher = patch('sys.stdout', cls.stdout)
+        cls._stdout_patcher.start()
+
+        # Compiled code is cached in a temporary directory rather than the
+        # user's cache
+        cls._cacheHome = tempfile.TemporaryDirectory()
+        cls._environ_patcher = patch.dict(os.environ,
+                                          XDG_CACHE_HOME=cls._cacheHome.name)
+        cls._environ_patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._stdout_patcher.stop()
+        cls._environ_patcher.stop()
+        cls._cacheHome.cleanup()
+        cls.stdout = None
+
     def setUp(self):
         reload(sleuth.inject)  # Nuke state stored within sleuth.inject
+        self.stdout.seek(0)
+        self.stdout.truncate()
         self._path = list(sys.path)
         self._argv = list(sys.argv)
         sys.argv[:] = [sleuth.__main__.__file__, fakescript_inj.__file__]
@@ -160,33 +215,109 @@ class TestInjectionFunctions(unittest.TestCase):
     def tearDown(self):
         sys.path[:] = self._path
         sys.argv[:] = self._argv
-        self.test_str = None
-        self.first_msg = None
-        self.second_msg = None
-        self.test_script = None
 
     def test_print_at(self):
-        with patch('sys.stdout', new=StringIO()) as fake_stdout:
-            print_at(self.test_script, 3, self.test_str)
+        print_at(self.test_script, 3, self.test_str)
+        sleuth.main()
+
+        self.stdout.seek(0)
+        self.assertEqual(self.stdout.readline().strip(), self.first_msg)
+        self.assertEqual(self.stdout.readline().strip(), self.test_str)
+        self.assertEqual(self.stdout.readline().strip(), self.second_msg)
+
+    def test_print_at_other_path(self):
+        # Test: Injections apply to a file however its path is written
+        script_dir, script_name = os.path.split(self.test_script)
+        other_path = os.path.join(script_dir, os.curdir, script_name)
+
+        print_at(other_path, 3, self.test_str)
+        sleuth.main()
+
+        self.stdout.seek(0)
+        self.assertEqual(self.stdout.readline().strip(), self.first_msg)
+        self.assertEqual(self.stdout.readline().strip(), self.test_str)
+        self.assertEqual(self.stdout.readline().strip(), self.second_msg)
+
+    def test_print_at_compound_statement(self):
+        print_at(self.test_script, 1, self.test_str)
+        sleuth.main()
+
+        self.stdout.seek(0)
+        self.assertEqual(self.stdout.readline().strip(), self.test_str)
+        self.assertEqual(self.stdout.readline().strip(), self.first_msg)
+        self.assertEqual(self.stdout.readline().strip(), self.second_msg)
+
+    def test_comment_at_with_print_at(self):
+        # Test: A commented line can be replaced with an injected action
+        comment_at(self.test_script, 2)
+        print_at(self.test_script, 2, self.test_str)
+        sleuth.main()
+
+        self.stdout.seek(0)
+        self.assertEqual(self.stdout.readline().strip(), self.test_str)
+        self.assertEqual(self.stdout.readline().strip(), self.second_msg)
+
+    def test_inject_hooks_nothing_to_inject(self):
+        with sleuth.inject.Injector() as inj:
+            tree = inj.inject_hooks(self.test_script)
+
+        with open(self.test_script) as f:
+            self.assertEqual(ast.dump(tree), ast.dump(ast.parse(f.read())))
+
+    def test_hook_lines_in_handlers(self):
+        # Test: Header lines of handlers are hooked in the handler body
+        source = textwrap.dedent("""\
+            try:
+                x = (1,
+                     2)
+            except ValueError:
+                pass
+            """)
+        tree = _HookInserter('script.py', [1, 2, 4, 5]).insert(
+            ast.parse(source))
+
+        hooked = [stmt.value.args[1].value for stmt in ast.walk(tree)
+                  if isinstance(stmt, ast.Expr) and
+                  isinstance(stmt.value, ast.Call) and
+                  getattr(stmt.value.func, 'id', None) == '__sleuth_hook__']
+        self.assertEqual(sorted(hooked), [1, 2, 4, 5])
+
+    def test_hook_lines_not_found(self):
+        # Test: Lines on which no statement can be hooked are reported
+        source = textwrap.dedent("""\
+            x = (1,
+                 2)
+            # Comment
+            """)
+        inserter = _HookInserter('script.py', [2, 3])
+        with self.assertRaisesRegex(sleuth.SleuthError, r'line\(s\) 2, 3'):
+            inserter.insert(ast.parse(source))
+
+    def test_break_at_line_in_function(self):
+        # Test: The frame of an action inside a function is at the line of
+        # the action
+        lines = []
+
+        def set_trace(frame, debugger):
+            lines.append((frame.f_code.co_name, frame.f_lineno))
+
+        break_at(self.test_script, 6)
+        with patch.object(sleuth.inject, 'set_trace', set_trace):
             sleuth.main()
 
-            fake_stdout.seek(0)
-            self.assertEqual(fake_stdout.readline().strip(), self.first_msg)
-            self.assertEqual(fake_stdout.readline().strip(), self.test_str)
-            self.assertEqual(fake_stdout.readline().strip(), self.second_msg)
+        self.assertEqual(lines, [('func', 6)])
 
     def test_call_at(self):
         def func():
             print(self.test_str)
 
-        with patch('sys.stdout', new=StringIO()) as fake_stdout:
-            call_at(self.test_script, 3, func)
-            sleuth.main()
+        call_at(self.test_script, 3, func)
+        sleuth.main()
 
-            fake_stdout.seek(0)
-            self.assertEqual(fake_stdout.readline().strip(), self.first_msg)
-            self.assertEqual(fake_stdout.readline().strip(), self.test_str)
-            self.assertEqual(fake_stdout.readline().strip(), self.second_msg)
+        self.stdout.seek(0)
+        self.assertEqual(self.stdout.readline().strip(), self.first_msg)
+        self.assertEqual(self.stdout.readline().strip(), self.test_str)
+        self.assertEqual(self.stdout.readline().strip(), self.second_msg)
 
 
 if __name__ == '__main__':
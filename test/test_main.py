@@ -1,13 +1,12 @@
 import importlib
 import os
+import subprocess
 import sys
+import tempfile
+import types
 import unittest
 from io import StringIO
-
-try:
-    from importlib import reload
-except ImportError:
-    from imp import reload
+from unittest.mock import patch
 
 import sleuth
 
@@ -16,21 +15,34 @@ import fakescript
 
 
 class TestSleuthMain(unittest.TestCase):
-    def setUp(self):
-        reload(fakemodule)
-        reload(fakescript)
-        self._path = sys.path[0]
-        self._argv = sys.argv
-        self._stdout = sys.stdout
-        sys.argv[:] = [sleuth.__main__.__file__, fakescript.__file__]
+    @classmethod
+    def setUpClass(cls):
+        cls._path = sys.path[0]
+        cls._argv = list(sys.argv)
+        cls._stdout = sys.stdout
         sys.stdout = StringIO()
 
-    def tearDown(self):
-        sys.path[0] = self._path
-        sys.argv[:] = self._argv
-        sys.stdout = self._stdout
-        fakemodule = None
-        fakescript = None
+        # Compiled code is cached in a temporary directory rather than the
+        # user's cache, including by sleuth run in a subprocess
+        cls._cacheHome = tempfile.TemporaryDirectory()
+        cls._environ_patcher = patch.dict(os.environ,
+                                          XDG_CACHE_HOME=cls._cacheHome.name)
+        cls._environ_patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path[0] = cls._path
+        sys.argv[:] = cls._argv
+        sys.stdout = cls._stdout
+        cls._environ_patcher.stop()
+        cls._cacheHome.cleanup()
+
+    def setUp(self):
+        fakemodule.reset()
+        # main() rewrites sys.argv, so it is set again for every test
+        sys.argv[:] = [sleuth.__main__.__file__, fakescript.__file__]
+        sys.stdout.seek(0)
+        sys.stdout.truncate()
 
     def test_main(self):
         # Test: Settings from the config file are applied to the script
@@ -46,8 +58,116 @@ class TestSleuthMain(unittest.TestCase):
         passedArgs = sys.stdout.getvalue().strip().split('\n')
         self.assertEqual(passedArgs, [fakescript.__file__] + scriptArgs)
 
+    def test_script_not_found(self):
+        # Test: A script path which can't be read from is reported as not
+        # found, whatever the reason
+        notAFile = os.path.join(fakescript.__file__, 'script.py')
+        for pyfile in ('missing_script.py', notAFile):
+            sys.argv[1:] = [pyfile]
+            self.assertRaises(sleuth.SleuthNotFoundError, sleuth.main)
+
+    def test_tap_config_function(self):
+        # Test: Functions defined in the config file can be tapped
+        config = ('import sleuth\n'
+                  'def helper():\n'
+                  '    return 1\n'
+                  'sleuth.tap(helper, sleuth.skip, returnValue=2)\n'
+                  'assert helper() == 2\n')
+        with tempfile.TemporaryDirectory() as configDir:
+            configFile = os.path.join(configDir, 'sleuthconfig.py')
+            with open(configFile, 'w') as f:
+                f.write(config)
+            sys.argv[1:1] = ['--config', configFile]
+            sleuth.main()
+
     def test_syspath(self):
         # Test: sys.path[0] is set to the directory where the script lives
         sleuth.main()
         scriptDir = os.path.dirname(os.path.realpath(fakescript.__file__))
         self.assertEqual(sys.path[0], scriptDir)
+
+    def test_run_module(self):
+        # Test: Sleuth runs the script with python -m sleuth, with and without
+        # a preserved environment
+        scriptDir = os.path.dirname(os.path.realpath(fakescript.__file__))
+        packageDir = os.path.dirname(os.path.dirname(sleuth.__file__))
+        env = dict(os.environ, PYTHONPATH=packageDir,
+                   XDG_CACHE_HOME=self._cacheHome.name)
+        for flags in ([], ['--preserve']):
+            cmd = ([sys.executable, '-m', 'sleuth'] + flags +
+                   [os.path.basename(fakescript.__file__), 'arg'])
+            output = subprocess.check_output(cmd, cwd=scriptDir, env=env,
+                                             stderr=subprocess.DEVNULL)
+            self.assertEqual(output.decode().split(), ['fakescript.py', 'arg'])
+
+    def test_compile_cached_on_disk(self):
+        # Test: Compiled code is reused from the on-disk cache in a later run
+        from sleuth import _util
+        source = b'x = 1\n'
+        with tempfile.TemporaryDirectory() as cacheHome:
+            with patch.dict(os.environ, XDG_CACHE_HOME=cacheHome), \
+                    patch.dict(_util._code_cache, clear=True), \
+                    patch('sys.dont_write_bytecode', False):
+                code = _util.compile_(source, 'config.py')
+                self.assertEqual(len(os.listdir(_util._cache_dir())), 1)
+
+                _util._code_cache.clear()
+                with patch('sleuth._util.compile') as fake_compile:
+                    cached = _util.compile_(source, 'config.py')
+                    self.assertFalse(fake_compile.called)
+                self.assertEqual(cached, code)
+
+    def test_compile_cache_keyed_by_optimization(self):
+        # Test: Code compiled at one optimization level isn't reused at
+        # another, since -O removes asserts
+        from sleuth import _util
+        source = b'assert False\n'
+        with tempfile.TemporaryDirectory() as cacheHome:
+            with patch.dict(os.environ, XDG_CACHE_HOME=cacheHome), \
+                    patch.dict(_util._code_cache, clear=True), \
+                    patch('sys.dont_write_bytecode', False):
+                _util.compile_(source, 'config.py')
+
+                _util._code_cache.clear()
+                optimized = types.SimpleNamespace(optimize=1)
+                with patch('sys.flags', optimized), \
+                        patch('sleuth._util.compile',
+                              wraps=compile) as fake_compile:
+                    _util.compile_(source, 'config.py')
+                    self.assertTrue(fake_compile.called)
+
+    def test_compile_cache_disabled(self):
+        # Test: Nothing is cached on disk when bytecode isn't written
+        from sleuth import _util
+        with tempfile.TemporaryDirectory() as cacheHome:
+            with patch.dict(os.environ, XDG_CACHE_HOME=cacheHome), \
+                    patch.dict(_util._code_cache, clear=True), \
+                    patch('sys.dont_write_bytecode', True):
+                _util.compile_(b'x = 1\n', 'config.py')
+                self.assertFalse(os.path.exists(_util._cache_dir()))
+
+    def test_compile_cache_bounded(self):
+        # Test: The oldest code is removed once the on-disk cache is full
+        from sleuth import _util
+        with tempfile.TemporaryDirectory() as cacheHome:
+            with patch.dict(os.environ, XDG_CACHE_HOME=cacheHome), \
+                    patch.dict(_util._code_cache, clear=True), \
+                    patch.object(_util, '_MAX_CACHED_CODE', 2), \
+                    patch('sys.dont_write_bytecode', False):
+                for i in range(3):
+                    _util.compile_('x = {0}\n'.format(i), 'config.py')
+                self.assertEqual(len(os.listdir(_util._cache_dir())), 2)
+
+    @unittest.skipUnless(os.path.isdir('/dev/fd'), 'requires /dev/fd')
+    def test_read_source_pipe(self):
+        # Test: Files which report a size of 0, such as pipes, are read
+        # until their end, e.g. a config given as --config <(...)
+        from sleuth._util import read_source
+        readFd, writeFd = os.pipe()
+        try:
+            os.write(writeFd, b'x = 1\n')
+            os.close(writeFd)
+            source = read_source('/dev/fd/{0}'.format(readFd))
+        finally:
+            os.close(readFd)
+        self.assertEqual(source, b'x = 1\n')
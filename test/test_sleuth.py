@@ -1,127 +1,156 @@
+import gc
 import importlib
 import logging
+import re
 import sys
+import types
 import unittest
+import weakref
 from functools import partial
-from io import StringIO
-
-try:
-    from unittest.mock import MagicMock
-except ImportError:
-    from mock import MagicMock
-
-try:
-    from importlib import reload
-except ImportError:
-    from imp import reload
+from unittest.mock import MagicMock, patch
 
 import sleuth
 
 import fakemodule
 
 
+ENTER_RE = re.compile(r'\S*\[\d+\] Calling \S+\(\)')
+EXIT_RE = re.compile(r'\S*\[\d+] Exiting \S+\(\)\s\[\d+\.\d+ seconds\]')
+EXCEPTION_RE = re.compile(r"Exception raised in \S*\(\): '\S*: \S*'")
+
+
 class TestSleuthLogging(unittest.TestCase):
+    # Immutable fixtures are shared by the tests. The exception is created
+    # for each test, since raising it again would extend its traceback.
+    ARGS = (42, 'test', 3.14)
+    KWARGS = types.MappingProxyType({'arg1': 10, 'arg2': 'hi'})
+    RETVAL = object()
+
+    # The log written to by default, i.e. the log named after the module of
+    # the wrapped functions
+    MODULE_LOGNAME = fakemodule.__name__
+    LOGNAME = 'testlog'
+
     def setUp(self):
-        reload(logging)
-        reload(fakemodule)
-        self.ARGS = (42, 'test', 3.14)
-        self.KWARGS = {'arg1': 10, 'arg2': 'hi'}
-        self.RETVAL = object()
+        fakemodule.reset()
         self.EXCEPTION = Exception()
-        self.LOGNAME = 'testlog'
-        self.LOG = StringIO()
-        logging.basicConfig(level=logging.DEBUG, stream=self.LOG)
-
-    def tearDown(self):
-        self.ARGS = None
-        self.KWARGS = None
-        self.RETVAL = None
-        self.EXCEPTION = None
-        self.LOGNAME = None
-        self.LOG = None
-        fakemodule = None
-        logging = None
+
+    def assertLogged(self, cm, regex):
+        """Check that a message captured by assertLogs() matches a regex."""
+        messages = [record.getMessage() for record in cm.records]
+        self.assertTrue(any(regex.search(msg) for msg in messages),
+                        '{0!r} not found in {1!r}'.format(regex.pattern,
+                                                          messages))
 
     def test_logCalls(self):
-        enterRegex = r'\S*\[\d+\] Calling \S+\(\)'
-        exitRegex = r'\S*\[\d+] Exiting \S+\(\)\s\[\d+\.\d+ seconds\]'
         sleuth.tap(fakemodule.doNothing, sleuth.logCalls)
-        fakemodule.doNothing(*self.ARGS, **self.KWARGS)
-        self.assertRegex(self.LOG.getvalue(), enterRegex)
-        self.assertRegex(self.LOG.getvalue(), exitRegex)
+        with self.assertLogs(self.MODULE_LOGNAME, level='DEBUG') as cm:
+            fakemodule.doNothing(*self.ARGS, **self.KWARGS)
+        self.assertLogged(cm, ENTER_RE)
+        self.assertLogged(cm, EXIT_RE)
 
     def test_logCalls_with_logName(self):
-        enterRegex = r'\S*{0}\S*\[\d+\] Calling \S+\(\)'.format(self.LOGNAME)
-        exitRegex = (r'\S*{0}\S*\[\d+] Exiting \S+\(\)\s\[\d+\.\d+ seconds\]'
-                     .format(self.LOGNAME))
         sleuth.tap(fakemodule.doNothing, sleuth.logCalls, logName=self.LOGNAME)
-        fakemodule.doNothing(*self.ARGS, **self.KWARGS)
-        self.assertRegex(self.LOG.getvalue(), enterRegex)
-        self.assertRegex(self.LOG.getvalue(), exitRegex)
+        with self.assertLogs(self.LOGNAME, level='DEBUG') as cm:
+            fakemodule.doNothing(*self.ARGS, **self.KWARGS)
+        self.assertLogged(cm, ENTER_RE)
+        self.assertLogged(cm, EXIT_RE)
+
+    def test_logCalls_call_number(self):
+        sleuth.tap(fakemodule.doNothing, sleuth.logCalls)
+        with self.assertLogs(self.MODULE_LOGNAME, level='DEBUG') as cm:
+            fakemodule.doNothing()
+            fakemodule.doNothing()
+        messages = [record.getMessage() for record in cm.records]
+        self.assertIn('[0] Calling doNothing()', messages)
+        self.assertIn('[1] Calling doNothing()', messages)
+
+    def test_logCalls_without_callTime(self):
+        # Test: The timer is not called if the call time is not logged
+        timerFunc = MagicMock(return_value=0)
+        sleuth.tap(fakemodule.returnValue, sleuth.logCalls,
+                   exitFmtStr='{funcName} returned {result}',
+                   timerFunc=timerFunc)
+        with self.assertLogs(self.MODULE_LOGNAME, level='DEBUG') as cm:
+            fakemodule.returnValue(self.RETVAL)
+        self.assertFalse(timerFunc.called)
+        self.assertIn('returnValue returned {0}'.format(self.RETVAL),
+                      [record.getMessage() for record in cm.records])
+
+    def test_logCalls_level_disabled(self):
+        # In this case, nothing should be logged because the log level is
+        # below the level of the logger
+        sleuth.tap(fakemodule.returnValue, sleuth.logCalls,
+                   level=logging.DEBUG - 1)
+        with self.assertNoLogs(self.MODULE_LOGNAME, level='DEBUG'):
+            result = fakemodule.returnValue(self.RETVAL)
+        self.assertEqual(result, self.RETVAL)
 
     def test_logOnException_with_exception(self):
-        caughtException = False
-        logRegex = r"Exception raised in \S*(): '\S*: \S*'"
         sleuth.tap(fakemodule.raiseException, sleuth.logOnException,
                    exceptionList=(Exception,))
 
-        try:
-            fakemodule.raiseException(self.EXCEPTION)
-        except Exception as e:
-            caughtException = True
-        finally:
-            self.assertTrue(caughtException)
-            self.assertRegex(self.LOG.getvalue(), logRegex)
+        with self.assertLogs(self.MODULE_LOGNAME, level='DEBUG') as cm:
+            with self.assertRaises(Exception):
+                fakemodule.raiseException(self.EXCEPTION)
+        self.assertLogged(cm, EXCEPTION_RE)
 
     def test_logOnException_with_exception_suppress(self):
-        logRegex = r"Exception raised in \S*(): '\S*: \S*'"
         sleuth.tap(fakemodule.raiseException, sleuth.logOnException,
                    exceptionList=(Exception,), suppress=True)
-        fakemodule.raiseException(self.EXCEPTION)
-        self.assertRegex(self.LOG.getvalue(), logRegex)
+        with self.assertLogs(self.MODULE_LOGNAME, level='DEBUG') as cm:
+            fakemodule.raiseException(self.EXCEPTION)
+        self.assertLogged(cm, EXCEPTION_RE)
 
     def test_logOnException_other_exception(self):
         # In this case, nothing should be logged because the raised exception
         # is not in exceptionList
-        caughtException = False
-        logRegex = r'^$'
         sleuth.tap(fakemodule.raiseException, sleuth.logOnException,
                    exceptionList=(ValueError,))
 
-        try:
-            fakemodule.raiseException(self.EXCEPTION)
-        except Exception as e:
-            caughtException = True
-        finally:
-            self.assertTrue(caughtException)
-            self.assertRegex(self.LOG.getvalue(), logRegex)
+        with self.assertNoLogs(self.MODULE_LOGNAME, level='DEBUG'):
+            with self.assertRaises(Exception):
+                fakemodule.raiseException(self.EXCEPTION)
+
+    def test_logOnException_logger_resolved_once(self):
+        # Test: The logger is looked up when the function is wrapped rather
+        # than each time an exception is logged
+        sleuth.tap(fakemodule.raiseException, sleuth.logOnException,
+                   exceptionList=(Exception,), suppress=True)
+        with self.assertLogs(self.MODULE_LOGNAME, level='DEBUG') as cm:
+            with patch('logging.getLogger') as fake_getLogger:
+                fakemodule.raiseException(self.EXCEPTION)
+                fakemodule.raiseException(self.EXCEPTION)
+                self.assertFalse(fake_getLogger.called)
+        self.assertEqual(len(cm.records), 2)
 
     def test_logOnException_no_exception(self):
-        logRegex = r'^$'
         sleuth.tap(fakemodule.doNothing, sleuth.logOnException,
                    exceptionList=(Exception,), suppress=True)
-        fakemodule.doNothing()
-        self.assertRegex(self.LOG.getvalue(), logRegex)
+        with self.assertNoLogs(self.MODULE_LOGNAME, level='DEBUG'):
+            fakemodule.doNothing()
 
 
 class TestSleuthBreakOn(unittest.TestCase):
+    ARGS = (42, 'test', 3.14)
+    KWARGS = types.MappingProxyType({'arg1': 10, 'arg2': 'hi'})
+    RETVAL = object()
+
+    @classmethod
+    def setUpClass(cls):
+        # sys.settrace is replaced by a mock for the whole class and reset
+        # before each test
+        cls._settrace_patcher = patch('sys.settrace')
+        cls._settrace_patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._settrace_patcher.stop()
 
     def setUp(self):
-        reload(sys)
-        reload(fakemodule)
-        self.ARGS = (42, 'test', 3.14)
-        self.KWARGS = {'arg1': 10, 'arg2': 'hi'}
-        self.RETVAL = object()
+        fakemodule.reset()
         self.EXCEPTION = Exception()
-        sys.settrace = MagicMock()
-
-    def tearDown(self):
-        self.ARGS = None
-        self.KWARGS = None
-        self.RETVAL = None
-        self.EXCEPTION = None
-        fakemodule = None
-        sys = None
+        sys.settrace.reset_mock()
 
     def test_breakOnEnter(self):
         sleuth.tap(fakemodule.doNothing, sleuth.breakOnEnter,
@@ -135,6 +164,16 @@ class TestSleuthBreakOn(unittest.TestCase):
         fakemodule.doNothing(*self.ARGS, **self.KWARGS)
         self.assertTrue(sys.settrace.called)
 
+    def test_breakOnExit_new_debugger(self):
+        # Test: The debugger is made when breaking rather than when the
+        # function is wrapped
+        sleuth.tap(fakemodule.doNothing, sleuth.breakOnExit,
+                   debugger='pdb')
+        with patch('pdb.Pdb') as fake_Pdb:
+            fakemodule.doNothing()
+            fakemodule.doNothing()
+        self.assertEqual(fake_Pdb.call_count, 2)
+
     def test_breakOnExit_ipdb(self):
         sleuth.tap(fakemodule.doNothing, sleuth.breakOnExit,
                    debugger='ipdb')
@@ -169,21 +208,22 @@ class TestSleuthBreakOn(unittest.TestCase):
     def test_breakOnException_with_exception(self):
         sleuth.tap(fakemodule.raiseException, sleuth.breakOnException,
                    exceptionList=(Exception,), debugger='pdb')
+        with self.assertRaises(type(self.EXCEPTION)):
+            fakemodule.raiseException(self.EXCEPTION)
+        self.assertTrue(sys.settrace.called)
+
+    def test_breakOnException_with_exception_suppress(self):
+        sleuth.tap(fakemodule.raiseException, sleuth.breakOnException,
+                   exceptionList=(Exception,), suppress=True, debugger='pdb')
         fakemodule.raiseException(self.EXCEPTION)
         self.assertTrue(sys.settrace.called)
 
     def test_breakOnException_other_exception(self):
-        caughtException = False
-
-        try:
-            sleuth.tap(fakemodule.raiseException, sleuth.breakOnException,
-                       exceptionList=(ValueError,), debugger='pdb')
+        sleuth.tap(fakemodule.raiseException, sleuth.breakOnException,
+                   exceptionList=(ValueError,), debugger='pdb')
+        with self.assertRaises(Exception):
             fakemodule.raiseException(self.EXCEPTION)
-        except Exception as e:
-            caughtException = True
-        finally:
-            self.assertTrue(caughtException)
-            self.assertFalse(sys.settrace.called)
+        self.assertFalse(sys.settrace.called)
 
     def test_breakOnException_no_exception(self):
         sleuth.tap(fakemodule.doNothing, sleuth.breakOnException,
@@ -193,22 +233,25 @@ class TestSleuthBreakOn(unittest.TestCase):
 
 
 class TestSleuthCallOn(unittest.TestCase):
+    ARGS = (42, 'test', 3.14)
+    KWARGS = types.MappingProxyType({'arg1': 10, 'arg2': 'hi'})
+    RETVAL = object()
+
+    @classmethod
+    def setUpClass(cls):
+        # The callback mock is shared by the tests and reset before each one
+        cls.CALLBACK = MagicMock()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.CALLBACK = None
+
     def setUp(self):
-        reload(fakemodule)
-        self.ARGS = (42, 'test', 3.14)
-        self.KWARGS = {'arg1': 10, 'arg2': 'hi'}
-        self.RETVAL = object()
+        fakemodule.reset()
         self.EXCEPTION = Exception()
         self.CALLBACK_RETVAL = object()
-        self.CALLBACK = MagicMock(return_value=self.CALLBACK_RETVAL)
-
-    def tearDown(self):
-        self.ARGS = None
-        self.KWARGS = None
-        self.RETVAL = None
-        self.EXCEPTION = None
-        self.CALLBACK = None
-        self.CALLBACK_RETVAL = None
+        self.CALLBACK.reset_mock(return_value=True, side_effect=True)
+        self.CALLBACK.return_value = self.CALLBACK_RETVAL
 
     def test_callOnEnter(self):
         sleuth.tap(fakemodule.doNothing, sleuth.callOnEnter,
@@ -217,6 +260,14 @@ class TestSleuthCallOn(unittest.TestCase):
         self.CALLBACK.assert_called_once_with(fakemodule.doNothing.__wrapped__,
                                               *self.ARGS, **self.KWARGS)
 
+    def test_callOnEnter_callable_without_names(self):
+        # Test: Callables without a __name__ or __qualname__ can be wrapped
+        func = partial(fakemodule.returnValue)
+        wrapped = sleuth.callOnEnter(func, callback=self.CALLBACK)
+        result = wrapped(self.RETVAL)
+        self.CALLBACK.assert_called_once_with(func, self.RETVAL)
+        self.assertEqual(result, self.RETVAL)
+
     def test_callOnEnter_check_return(self):
         sleuth.tap(fakemodule.returnValue, sleuth.callOnEnter,
                    callback=self.CALLBACK)
@@ -225,6 +276,17 @@ class TestSleuthCallOn(unittest.TestCase):
             fakemodule.returnValue.__wrapped__, self.RETVAL)
         self.assertEqual(result, self.RETVAL)
 
+    def test_callOnEnter_method(self):
+        # Test: A wrapped method is still bound to its instance
+        sleuth.tap(fakemodule.FakeClass.returnValue, sleuth.callOnEnter,
+                   callback=self.CALLBACK)
+        instance = fakemodule.FakeClass()
+        result = instance.returnValue(self.RETVAL)
+        self.CALLBACK.assert_called_once_with(
+            fakemodule.FakeClass.returnValue.__wrapped__, instance,
+            self.RETVAL)
+        self.assertEqual(result, self.RETVAL)
+
     def test_callOnExit(self):
         sleuth.tap(fakemodule.returnValue, sleuth.callOnExit,
                    callback=self.CALLBACK)
@@ -258,17 +320,40 @@ class TestSleuthCallOn(unittest.TestCase):
         # Don't suppress exception
         self.CALLBACK.return_value = False
 
-        caughtException = False
+        sleuth.tap(fakemodule.raiseException, sleuth.callOnException,
+                   exceptionList=(Exception,), callback=self.CALLBACK)
+        with self.assertRaises(Exception):
+            fakemodule.raiseException(self.EXCEPTION)
+        self.CALLBACK.assert_called_once_with(
+            fakemodule.raiseException.__wrapped__, self.EXCEPTION)
+
+    def test_callOnException_traceback(self):
+        # Test: A reraised exception keeps the traceback of the wrapped
+        # function
+        self.CALLBACK.return_value = False
+
         sleuth.tap(fakemodule.raiseException, sleuth.callOnException,
                    exceptionList=(Exception,), callback=self.CALLBACK)
         try:
             fakemodule.raiseException(self.EXCEPTION)
         except Exception as e:
-            caughtException = True
-        finally:
-            self.assertTrue(caughtException)
-            self.CALLBACK.assert_called_once_with(
-                fakemodule.raiseException.__wrapped__, self.EXCEPTION)
+            tb = e.__traceback__
+        else:
+            self.fail('Exception not raised')
+
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        self.assertEqual(tb.tb_frame.f_code.co_name, 'raiseException')
+
+    def test_callOnException_exception_list(self):
+        # Test: Exceptions may be given in a list
+        self.CALLBACK.return_value = True
+
+        sleuth.tap(fakemodule.raiseException, sleuth.callOnException,
+                   exceptionList=[ValueError, type(self.EXCEPTION)],
+                   callback=self.CALLBACK)
+        fakemodule.raiseException(self.EXCEPTION)
+        self.assertTrue(self.CALLBACK.called)
 
     def test_callOnException_with_exception_suppress(self):
         # Suppress exception
@@ -281,20 +366,14 @@ class TestSleuthCallOn(unittest.TestCase):
             fakemodule.raiseException.__wrapped__, self.EXCEPTION)
 
     def test_callOnException_other_exception(self):
-        caughtException = False
-
-        try:
-            # Suppress exception if callback is called
-            self.CALLBACK.return_value = True
+        # Suppress exception if callback is called
+        self.CALLBACK.return_value = True
 
-            sleuth.tap(fakemodule.raiseException, sleuth.callOnException,
-                       exceptionList=(ValueError,), callback=self.CALLBACK)
+        sleuth.tap(fakemodule.raiseException, sleuth.callOnException,
+                   exceptionList=(ValueError,), callback=self.CALLBACK)
+        with self.assertRaises(Exception):
             fakemodule.raiseException(self.EXCEPTION)
-        except Exception as e:
-            caughtException = True
-        finally:
-            self.assertTrue(caughtException)
-            self.assertFalse(self.CALLBACK.called)
+        self.assertFalse(self.CALLBACK.called)
 
     def test_callOnException_no_exception(self):
         sleuth.tap(fakemodule.returnValue, sleuth.callOnException,
@@ -306,15 +385,10 @@ class TestSleuthCallOn(unittest.TestCase):
 
 class TestSleuthMisc(unittest.TestCase):
     def setUp(self):
-        reload(fakemodule)
+        fakemodule.reset()
         self.SKIP_RETVAL = object()
         self.RETVAL = object()
 
-    def tearDown(self):
-        self.SKIP_RETVAL = None
-        self.RETVAL = None
-        fakemodule = None
-
     def test_skip_no_retval(self):
         sleuth.tap(fakemodule.doNothing, sleuth.skip)
         fakemodule.doNothing()
@@ -327,6 +401,112 @@ class TestSleuthMisc(unittest.TestCase):
         self.assertFalse(fakemodule.doNothing.called)
         self.assertEqual(result, self.SKIP_RETVAL)
 
+    def test_skip_signature(self):
+        # Test: The skipping function takes the same arguments as the
+        # wrapped function
+        def func(a, b=1, /, c=2, *args, d, e=3, **kwargs):
+            pass
+
+        skipped = sleuth.skip(func, returnValue=self.SKIP_RETVAL)
+        self.assertEqual(skipped(0, d=4), self.SKIP_RETVAL)
+        self.assertEqual(skipped(0, 1, 2, 3, d=4, f=5), self.SKIP_RETVAL)
+        self.assertRaises(TypeError, skipped, 0)
+        self.assertRaises(TypeError, skipped, a=0, d=4)
+
+    def test_wrapper_annotations(self):
+        # Test: Wrappers keep the annotations of the wrapped function
+        def func(a: int) -> str:
+            pass
+
+        wrapped = sleuth.logCalls(func)
+        self.assertEqual(wrapped.__annotations__, func.__annotations__)
+
+    def test_skip_bound_method(self):
+        # Test: A bound method is skipped without its instance as an argument
+        obj = fakemodule.FakeClass()
+        skipped = sleuth.skip(obj.returnValue, returnValue=self.SKIP_RETVAL)
+        self.assertEqual(skipped(self.RETVAL), self.SKIP_RETVAL)
+
+    def test_tap_method(self):
+        sleuth.tap(fakemodule.FakeClass.returnValue, sleuth.skip,
+                   returnValue=self.SKIP_RETVAL)
+        result = fakemodule.FakeClass().returnValue(self.RETVAL)
+        self.assertEqual(result, self.SKIP_RETVAL)
+
+    def test_tap_nested_function(self):
+        sleuth.tap(fakemodule.FakeNamespace.nested, sleuth.skip,
+                   returnValue=self.SKIP_RETVAL)
+        result = fakemodule.FakeNamespace.nested(self.RETVAL)
+        self.assertEqual(result, self.SKIP_RETVAL)
+
+    def test_tap_twice(self):
+        # Test: Tapping a function again replaces the first wrapper
+        sleuth.tap(fakemodule.returnValue, sleuth.skip,
+                   returnValue=self.SKIP_RETVAL)
+        sleuth.tap(fakemodule.returnValue.__wrapped__, sleuth.skip,
+                   returnValue=self.RETVAL)
+        result = fakemodule.returnValue(None)
+        self.assertEqual(result, self.RETVAL)
+
+    def test_tap_does_not_keep_module_alive(self):
+        # Test: Tapping a function in a module doesn't stop the module and
+        # its classes being collected once they are no longer used
+        module = types.ModuleType('fakemodule_tmp')
+        exec('class Tmp:\n'
+             '    def method(self):\n'
+             '        return 1', vars(module))
+        sys.modules[module.__name__] = module
+        try:
+            sleuth.tap(module.Tmp.method, sleuth.skip)
+        finally:
+            del sys.modules[module.__name__]
+
+        moduleRef = weakref.ref(module)
+        classRef = weakref.ref(module.Tmp)
+        del module
+        gc.collect()
+        self.assertIsNone(moduleRef())
+        self.assertIsNone(classRef())
+
+    def test_tap_function_held_by_other_package(self):
+        # Test: A function is found when it is only held by a class from
+        # another package
+        module = types.ModuleType('fakemodule_tmp')
+        exec('def func():\n'
+             '    return 1', vars(module))
+        otherModule = types.ModuleType('otherpackage_tmp')
+        exec('class Holder:\n'
+             '    pass', vars(otherModule))
+        otherModule.Holder.func = module.func
+        module.otherModule = otherModule
+        del module.func
+
+        sys.modules[module.__name__] = module
+        try:
+            sleuth.tap(otherModule.Holder.func, sleuth.skip,
+                       returnValue=self.SKIP_RETVAL)
+        finally:
+            del sys.modules[module.__name__]
+        self.assertEqual(otherModule.Holder.func(), self.SKIP_RETVAL)
+
+    def test_tap_staticmethod_found_by_search(self):
+        # Test: A static method is found when its qualified name doesn't
+        # lead to it
+        module = types.ModuleType('fakemodule_tmp')
+        exec('def func():\n'
+             '    return 1\n'
+             'class Holder:\n'
+             '    func = staticmethod(func)\n'
+             'del func', vars(module))
+
+        sys.modules[module.__name__] = module
+        try:
+            sleuth.tap(module.Holder.func, sleuth.skip,
+                       returnValue=self.SKIP_RETVAL)
+        finally:
+            del sys.modules[module.__name__]
+        self.assertEqual(module.Holder.func(), self.SKIP_RETVAL)
+
     def test_substitue(self):
         sleuth.tap(fakemodule.doNothing, sleuth.substitute,
                    replacement=fakemodule.returnValue)
@@ -334,6 +514,14 @@ class TestSleuthMisc(unittest.TestCase):
         self.assertFalse(fakemodule.doNothing.called)
         self.assertEqual(result, self.RETVAL)
 
+    def test_substitute_replacement_unchanged(self):
+        # Test: The replacement function itself is not modified to look
+        # like the wrapped function
+        sleuth.tap(fakemodule.doNothing, sleuth.substitute,
+                   replacement=fakemodule.returnValue)
+        self.assertEqual(fakemodule.returnValue.__name__, 'returnValue')
+        self.assertFalse(hasattr(fakemodule.returnValue, '__wrapped__'))
+
 
 if __name__ == '__main__':
     unittest.main()